@@ -1,32 +1,149 @@
-import os
-import tempfile
+import hashlib
+import io
+import queue
+import threading
+import time
 import streamlit as st
 from streamlit_pdf_viewer import pdf_viewer
 
-from backend.pii_detector import SUPPORTED_ENTITIES, detect_pii_entities
-from backend.pdf_loader import extract_pdf_text, get_pdf_metadata, is_scanned_pdf
+from backend.pii_detector import (
+    ACCURATE_SPACY_MODEL,
+    FAST_SPACY_MODEL,
+    SUPPORTED_ENTITIES,
+    detect_pii_entities,
+    get_analyzer,
+    select_spacy_model,
+)
+from backend.pdf_loader import load_pdf_text, probe_pdf
 from backend.redactor import redact_pii, highlight_pii
 from backend.pdf_writer import redact_pdf
 
 st.set_page_config(page_title="PDF PII Redactor", layout="wide")
 
+PREVIEW_LENGTH = 500
+
+@st.cache_resource(show_spinner="Loading PII models...")
+def _get_analyzer(model_name: str):
+    # cache_resource hands back the same engine without the pickling cache_data would do
+    return get_analyzer(model_name)
+
+_get_analyzer(select_spacy_model())
+
+# Cached helpers key on the upload's digest; the leading underscore on _file_bytes
+# tells Streamlit not to hash the full PDF on every rerun.
+@st.cache_data(show_spinner=False)
+def _probe_pdf(file_digest: str, _file_bytes: bytes) -> tuple[dict, bool]:
+    # Streamlit reruns the whole script on every widget change; only parse once per upload
+    return probe_pdf(_file_bytes)
+
+@st.cache_data(show_spinner=False)
+def _load_text(file_digest: str, _file_bytes: bytes) -> tuple[str, bool]:
+    # One pass gives both the text and whether the PDF needed OCR
+    return load_pdf_text(_file_bytes)
+
+@st.cache_data(show_spinner=False)
+def _extract_and_detect(
+    file_digest: str, _file_bytes: bytes, threshold: float, model_name: str, entity_types: tuple
+) -> tuple[str, list]:
+    text, _ = _load_text(file_digest, _file_bytes)
+    if not entity_types:
+        return text, []
+    # None (all types) keeps Presidio's full pass; a narrower list lets the detector take its fast paths
+    selected_entities = list(entity_types) if set(entity_types) != set(SUPPORTED_ENTITIES) else None
+    return text, detect_pii_entities(
+        text, threshold=threshold, selected_entities=selected_entities, analyzer=_get_analyzer(model_name)
+    )
+
+@st.cache_data(show_spinner=False)
+def _highlight_preview(sample_text: str, entities: tuple) -> str:
+    # Cached so reruns reuse the same HTML (and the same legend colours)
+    return highlight_pii(sample_text, list(entities))
+
+def _run_redact(progress_queue, file_bytes, **redact_kwargs):
+    # Runs on a worker thread: no st.* calls here, only messages on the queue
+    output_buffer = io.BytesIO()
+    success = redact_pdf(
+        file_bytes,
+        output_buffer,
+        progress_callback=lambda done, total: progress_queue.put(("progress", done, total)),
+        **redact_kwargs
+    )
+    progress_queue.put(("done", output_buffer.getvalue() if success else None))
+
+@st.cache_data(show_spinner=False)
+def _cached_redact(text: str, redaction_type: str, entities: tuple, custom_mask_text: str) -> str:
+    # Reuses the spans found in step 1 instead of running detection on the preview again
+    redacted_text, _ = redact_pii(
+        text,
+        redaction_type=redaction_type,
+        custom_mask_text=custom_mask_text,
+        entities=entities
+    )
+    return redacted_text
+
+@st.fragment
+def _render_selection_and_preview():
+    # A fragment: changing the selection reruns only this block, not the PDF viewer below it
+    detected_types = list(st.session_state.detected_entities_dict)
+    selected_entities = st.multiselect(
+        "PII Types to Redact",
+        options=detected_types,
+        default=detected_types,
+        format_func=lambda etype: f"{etype} ({len(st.session_state.detected_entities_dict[etype])})"
+    )
+    st.session_state.selected_pii_types_to_redact = selected_entities
+    entities_to_redact_for_preview = []
+    for etype in selected_entities:
+        for entity_text, start, end in st.session_state.detected_entities_dict.get(etype, []):
+            if start < PREVIEW_LENGTH:
+                entities_to_redact_for_preview.append((entity_text, etype, start, end))
+    sample_text = st.session_state.extracted_text[:PREVIEW_LENGTH]
+    st.markdown(_highlight_preview(sample_text, tuple(entities_to_redact_for_preview)), unsafe_allow_html=True)
+    redacted_sample = _cached_redact(
+        sample_text,
+        st.session_state.redaction_type,
+        tuple(e for e in entities_to_redact_for_preview if e[3] <= len(sample_text)),
+        st.session_state.custom_mask_text
+    )
+    st.text_area("Redacted Preview", redacted_sample, height=200)
+
 # Session state
 if 'step' not in st.session_state:
     st.session_state.step = 1
 if 'detected_entities_dict' not in st.session_state:
     st.session_state.detected_entities_dict = {}
-if 'pdf_path' not in st.session_state:
-    st.session_state.pdf_path = None
+if 'file_bytes' not in st.session_state:
+    st.session_state.file_bytes = None
+if 'pdf_name' not in st.session_state:
+    st.session_state.pdf_name = None
+if 'upload_id' not in st.session_state:
+    st.session_state.upload_id = None
+if 'file_digest' not in st.session_state:
+    st.session_state.file_digest = None
+if 'pdf_metadata' not in st.session_state:
+    st.session_state.pdf_metadata = None
 if 'extracted_text' not in st.session_state:
     st.session_state.extracted_text = ""
+if 'scanned' not in st.session_state:
+    st.session_state.scanned = False
 if 'redaction_type' not in st.session_state:
     st.session_state.redaction_type = "black_bar"
 if 'custom_mask_text' not in st.session_state:
     st.session_state.custom_mask_text = "[REDACTED]"
 if 'detection_threshold' not in st.session_state:
     st.session_state.detection_threshold = 0.2
+if 'high_accuracy' not in st.session_state:
+    st.session_state.high_accuracy = False
+if 'detect_entity_types' not in st.session_state:
+    st.session_state.detect_entity_types = list(SUPPORTED_ENTITIES)
 if 'selected_pii_types_to_redact' not in st.session_state:
     st.session_state.selected_pii_types_to_redact = []
+if 'redacted_pdf_bytes' not in st.session_state:
+    st.session_state.redacted_pdf_bytes = None
+if 'redacted_pdf_name' not in st.session_state:
+    st.session_state.redacted_pdf_name = None
+if 'redact_job' not in st.session_state:
+    st.session_state.redact_job = None
 
 with st.sidebar:
     st.header("Settings")
@@ -36,6 +153,23 @@ with st.sidebar:
         help="Lower values detect more potential PII but may increase false positives",
         key="detection_threshold_slider_key"
     )
+    with st.expander("Advanced Options"):
+        # Only offered when a faster model is configured (PII_SPACY_MODEL); otherwise both are the same
+        if FAST_SPACY_MODEL != ACCURATE_SPACY_MODEL:
+            st.session_state.high_accuracy = st.checkbox(
+                "High accuracy mode (slower)",
+                value=st.session_state.high_accuracy,
+                help=f"Use {ACCURATE_SPACY_MODEL} instead of {FAST_SPACY_MODEL} for name/place/organisation "
+                     "detection. Always used when sensitivity is below 0.2.",
+                key="high_accuracy_checkbox_key"
+            )
+        st.session_state.detect_entity_types = st.multiselect(
+            "PII types to detect",
+            options=SUPPORTED_ENTITIES,
+            default=st.session_state.detect_entity_types,
+            help="Detecting only ID, card, phone and email types skips the name/place model entirely.",
+            key="detect_entity_types_key"
+        )
     if st.session_state.step == 2:
         redaction_options = [
             {"id": "black_bar", "name": "Black Bar", "icon": "⬛"},
@@ -67,82 +201,108 @@ if st.session_state.step == 1:
     st.header("Step 1: Upload and Detect PII")
     uploaded_file = st.file_uploader("Upload PDF", type="pdf")
     if uploaded_file:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            st.session_state.pdf_path = tmp_file.name
-        metadata = get_pdf_metadata(st.session_state.pdf_path)
-        st.write(metadata)
-        st.session_state.extracted_text = extract_pdf_text(st.session_state.pdf_path)
+        if st.session_state.upload_id != uploaded_file.file_id:
+            # Copy and hash the upload once; the backend opens PDFs straight from these bytes
+            file_bytes = uploaded_file.getvalue()
+            file_digest = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+            metadata, pdf_ok = _probe_pdf(file_digest, file_bytes)
+            st.session_state.file_bytes = file_bytes
+            st.session_state.file_digest = file_digest
+            st.session_state.pdf_name = uploaded_file.name
+            # Probe and extract only for a new upload; other widget reruns reuse session state
+            st.session_state.pdf_metadata = metadata if pdf_ok else None
+            if pdf_ok:
+                st.session_state.extracted_text, st.session_state.scanned = _load_text(file_digest, file_bytes)
+            st.session_state.upload_id = uploaded_file.file_id
+        file_bytes = st.session_state.file_bytes
+        file_digest = st.session_state.file_digest
+        if st.session_state.pdf_metadata is None:
+            st.error("The uploaded file is not a readable PDF.")
+            st.stop()
+        st.write(st.session_state.pdf_metadata)
         st.text_area("Extracted Text", st.session_state.extracted_text[:2000], height=300)
         if st.button("Detect PII Entities"):
-            entities = detect_pii_entities(
-                st.session_state.extracted_text,
-                threshold=st.session_state.detection_threshold
+            _, entities = _extract_and_detect(
+                file_digest,
+                file_bytes,
+                st.session_state.detection_threshold,
+                select_spacy_model(
+                    st.session_state.high_accuracy,
+                    st.session_state.detection_threshold,
+                    st.session_state.detect_entity_types
+                ),
+                tuple(st.session_state.detect_entity_types)
             )
             entity_dict = {}
             for text, etype, start, end in entities:
-                if etype not in entity_dict:
-                    entity_dict[etype] = []
-                entity_dict[etype].append((text, start, end))
+                entity_dict.setdefault(etype, []).append((text, start, end))
             st.session_state.detected_entities_dict = entity_dict
             st.session_state.step = 2
             st.rerun()
 
 elif st.session_state.step == 2:
     st.header("Step 2: Select PII to Redact & Preview")
-    selected_types = {}
-    for etype, items in st.session_state.detected_entities_dict.items():
-        selected = st.checkbox(etype, value=True, key=f"chk_{etype}")
-        selected_types[etype] = selected
-    selected_entities = [etype for etype, sel in selected_types.items() if sel]
-    st.session_state.selected_pii_types_to_redact = selected_entities
-    entities_to_redact_for_preview = []
-    for etype in selected_entities:
-        for entity_text, start, end in st.session_state.detected_entities_dict.get(etype, []):
-            if start < 500:
-                entities_to_redact_for_preview.append((entity_text, etype, start, end))
-    sample_text = st.session_state.extracted_text[:500]
-    st.markdown(highlight_pii(sample_text, entities_to_redact_for_preview), unsafe_allow_html=True)
-    redacted_sample, _ = redact_pii(
-        sample_text,
-        redaction_type=st.session_state.redaction_type,
-        selected_entities=selected_entities,
-        threshold=st.session_state.detection_threshold,
-        custom_mask_text=st.session_state.custom_mask_text
-    )
-    st.text_area("Redacted Preview", redacted_sample, height=200)
-    if st.button("Redact PDF and Show Preview"):
-        output_filename = f"redacted_{os.path.basename(st.session_state.pdf_path)}"
-        output_path = os.path.join(tempfile.gettempdir(), output_filename)
+    _render_selection_and_preview()
+    if st.button("Redact PDF and Show Preview", disabled=st.session_state.redact_job is not None):
         full_entities_to_redact = []
-        for etype in selected_entities:
+        for etype in st.session_state.selected_pii_types_to_redact:
             for text, start, end in st.session_state.detected_entities_dict[etype]:
                 full_entities_to_redact.append((text, etype, start, end))
-        scanned = is_scanned_pdf(st.session_state.pdf_path)
-        success = redact_pdf(
-            st.session_state.pdf_path,
-            output_path,
-            redaction_type=st.session_state.redaction_type,
-            entities_to_redact=full_entities_to_redact,
-            custom_mask_text=st.session_state.custom_mask_text,
-            threshold=st.session_state.detection_threshold,
-            scanned=scanned
-        )
-        if success:
-            with open(output_path, "rb") as f:
-                pdf_bytes = f.read()
-            st.success("PDF successfully redacted!")
-            pdf_viewer(pdf_bytes, width=900, height=800)
-            st.download_button(
-                label="Download Redacted PDF",
-                data=pdf_bytes,
-                file_name=output_filename,
-                mime="application/pdf"
-            )
+        # Redact on a background thread so the script is not blocked while the PDF is written
+        progress_queue = queue.Queue()
+        threading.Thread(
+            target=_run_redact,
+            args=(progress_queue, st.session_state.file_bytes),
+            kwargs=dict(
+                redaction_type=st.session_state.redaction_type,
+                entities_to_redact=full_entities_to_redact,
+                custom_mask_text=st.session_state.custom_mask_text,
+                threshold=st.session_state.detection_threshold,
+                scanned=st.session_state.scanned
+            ),
+            daemon=True
+        ).start()
+        st.session_state.redacted_pdf_bytes = None
+        st.session_state.redacted_pdf_name = f"redacted_{st.session_state.pdf_name}"
+        st.session_state.redact_job = {"queue": progress_queue, "progress": 0.0}
+    job = st.session_state.redact_job
+    if job is not None:
+        finished = False
+        while True:
+            try:
+                kind, *payload = job["queue"].get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                done, total = payload
+                job["progress"] = done / total if total else 1.0
+            else:
+                finished = True
+                # Later reruns render the viewer and download button from session state
+                st.session_state.redacted_pdf_bytes = payload[0]
+        if finished:
+            st.session_state.redact_job = None
+            if st.session_state.redacted_pdf_bytes is None:
+                st.error("Failed to redact PDF. Please try again.")
         else:
-            st.error("Failed to redact PDF. Please try again.")
+            st.progress(job["progress"], text="Redacting PDF...")
+    if st.session_state.redacted_pdf_bytes:
+        st.success("PDF successfully redacted!")
+        pdf_viewer(st.session_state.redacted_pdf_bytes, width=900, height=800)
+        st.download_button(
+            label="Download Redacted PDF",
+            data=st.session_state.redacted_pdf_bytes,
+            file_name=st.session_state.redacted_pdf_name,
+            mime="application/pdf"
+        )
     if st.button("Back to Upload/Detection"):
         st.session_state.step = 1
         st.session_state.detected_entities_dict = {}
         st.session_state.selected_pii_types_to_redact = []
+        st.session_state.redacted_pdf_bytes = None
+        st.session_state.redact_job = None
+        st.rerun()
+    if st.session_state.redact_job is not None:
+        # Poll the worker thread until it reports completion
+        time.sleep(0.5)
         st.rerun()
@@ -1,10 +1,17 @@
+import fitz
 import pytesseract
-from pdf2image import convert_from_path
 from PIL import Image
 import cv2
 import numpy as np
 import os
+import hashlib
 import logging
+import multiprocessing
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,24 +22,250 @@ if os.path.exists(TESSERACT_PATH):
 else:
     logger.warning(f"Tesseract not found at {TESSERACT_PATH}. OCR may not work properly.")
 
+# 150 DPI grayscale holds typed text well for Tesseract at a quarter of the 300 DPI RGB pixel data
+OCR_DPI = int(os.environ.get("OCR_DPI", "150"))
+# Pages that OCR poorly at OCR_DPI are re-rendered and OCR'd once at this resolution
+OCR_RETRY_DPI = int(os.environ.get("OCR_RETRY_DPI", "300"))
+# A page counts as poorly OCR'd below this mean word confidence or with fewer words than this
+OCR_RETRY_MIN_CONF = 40
+OCR_RETRY_MIN_WORDS = 5
+# LSTM engine only; page segmentation is left on auto so multi-column layouts still work.
+# Pages are binarised dark-on-light by preprocess_image, so Tesseract's inverted-text pass is skipped.
+TESSERACT_CONFIG = "--oem 1 -c tessedit_do_invert=0"
+# Parallelism comes from one Tesseract process per pool worker; letting each also start an OpenMP
+# thread per core oversubscribes the CPU. Set before the pool exists so workers inherit it.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# Leave one core for the Streamlit server while the pool is busy
+POOL_WORKERS = max((os.cpu_count() or 1) - 1, 1)
+_pool = None
+_pool_lock = threading.Lock()
+
+# Most recent OCR results (text and word boxes only), so redaction can reuse what extraction computed
+OCR_CACHE_SIZE = 8
+_ocr_cache = OrderedDict()
+_ocr_cache_lock = threading.Lock()
+
+def _ocr_cache_key(pdf_source, dpi):
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return hashlib.blake2b(pdf_source, digest_size=16).hexdigest(), dpi
+    stat = os.stat(pdf_source)
+    return pdf_source, stat.st_mtime_ns, stat.st_size, dpi
+
+def get_process_pool():
+    """
+    Process pool shared by OCR and parallel text extraction, started once per process
+    so each document does not pay for spawning workers again.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver rather than fork on POSIX: forking the multi-threaded Streamlit server
+            # can leave a worker holding a lock some other thread owned. Windows always spawns.
+            context = multiprocessing.get_context("forkserver") if os.name == "posix" else None
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=context)
+        return _pool
+
+def reset_process_pool():
+    """
+    Drop a pool whose worker died so the next caller starts a fresh one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def _open_pdf(pdf_source):
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return fitz.open(stream=pdf_source, filetype="pdf")
+    return fitz.open(pdf_source)
+
+@contextmanager
+def _document(pdf_source, doc=None):
+    # Use the caller's open fitz document when given one (and leave closing it to them)
+    if doc is not None:
+        yield doc
+    else:
+        with _open_pdf(pdf_source) as opened:
+            yield opened
+
+def _render_page(page, dpi, color=False):
+    colorspace, mode = (fitz.csRGB, "RGB") if color else (fitz.csGRAY, "L")
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=colorspace, alpha=False)
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+def iter_page_images(pdf_source, dpi=OCR_DPI, doc=None, start=0, stop=None, color=False):
+    """
+    Yield each page rasterised in-process with PyMuPDF, one at a time so only the page being
+    worked on is held in memory. Pages are 8-bit grayscale for OCR, or RGB when color is set.
+    Pass an already open fitz document as doc to avoid parsing the PDF again,
+    and start/stop to render only that range of pages.
+    """
+    with _document(pdf_source, doc) as doc:
+        for page in doc.pages(start, stop):
+            yield _render_page(page, dpi, color)
+
+def _scale_ocr_data(ocr_data, factor):
+    # Map word boxes from a retry render back to the coordinates of the OCR_DPI render
+    for key in ("left", "top", "width", "height"):
+        ocr_data[key] = [round(value * factor) for value in ocr_data[key]]
+    return ocr_data
+
+def _page_quality(ocr_data):
+    # (word count, mean confidence) of a page; Tesseract reports conf -1 for non-word boxes
+    confs = [float(conf) for conf, word in zip(ocr_data["conf"], ocr_data["text"])
+             if float(conf) >= 0 and word.strip()]
+    return len(confs), (sum(confs) / len(confs) if confs else 0.0)
+
+def _needs_retry(ocr_data):
+    # Level-5 boxes are word candidates; a page with none has no ink (or no text-like ink) for a
+    # sharper render to recover, so blank separator pages are never retried
+    if 5 not in ocr_data["level"]:
+        return False
+    words, mean_conf = _page_quality(ocr_data)
+    return words < OCR_RETRY_MIN_WORDS or mean_conf < OCR_RETRY_MIN_CONF
+
+def _ocr_pages_pooled(images, workers):
+    # Yield OCR results in order, keeping at most two pages per worker in flight
+    pending = deque()
+    executor = get_process_pool()
+    for img in images:
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+        pending.append(executor.submit(_ocr_page_payload, _encode_page(img)))
+    for future in pending:
+        yield future.result()
+
+def _retry_weak_pages(doc, results, dpi, workers):
+    """
+    Re-OCR, at OCR_RETRY_DPI, only the pages whose base-resolution OCR found too few words
+    or read them with low confidence. The retry is kept only if its summed word confidence is
+    higher, so extra low-confidence noise from the sharper render does not win on word count alone.
+    """
+    # Pixel-identical pages share one result object; retry each of those once
+    retry = OrderedDict()
+    for i, result in enumerate(results):
+        if _needs_retry(result[1]):
+            retry.setdefault(id(result), []).append(i)
+    if not retry or OCR_RETRY_DPI <= dpi:
+        return
+    logger.info(f"Retrying OCR for {len(retry)} page(s) at {OCR_RETRY_DPI} DPI")
+    images = (_render_page(doc[pages[0]], OCR_RETRY_DPI) for pages in retry.values())
+    if len(retry) > 1 and workers > 1:
+        retried = _ocr_pages_pooled(images, workers)
+    else:
+        retried = (_ocr_page(img) for img in images)
+    for pages, (text, ocr_data) in zip(retry.values(), retried):
+        words, mean_conf = _page_quality(ocr_data)
+        old_words, old_conf = _page_quality(results[pages[0]][1])
+        if words * mean_conf > old_words * old_conf:
+            improved = (text, _scale_ocr_data(ocr_data, dpi / OCR_RETRY_DPI))
+            for i in pages:
+                results[i] = improved
+
 def preprocess_image(image):
-    gray = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
-    denoised = cv2.fastNlMeansDenoising(gray, h=10)
-    _, thresh = cv2.threshold(denoised, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    return Image.fromarray(thresh)
+    """
+    Denoise and binarise a page for OCR. Returns the single-channel uint8 array directly,
+    which pytesseract accepts, instead of wrapping it back into a PIL image.
+    """
+    gray = np.asarray(image)
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_RGB2GRAY)
+    # A 3x3 median removes scanner speckle at a tiny fraction of fastNlMeansDenoising's cost
+    denoised = cv2.medianBlur(gray, 3)
+    # Threshold in place: the blurred copy is not needed afterwards
+    cv2.threshold(denoised, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=denoised)
+    return denoised
+
+def _text_from_ocr_data(ocr_data):
+    # Rebuild the image_to_string layout from the word boxes: words of a line joined by spaces,
+    # lines by newlines and a blank line between paragraphs
+    lines = OrderedDict()
+    for block, par, line, word in zip(
+        ocr_data["block_num"], ocr_data["par_num"], ocr_data["line_num"], ocr_data["text"]
+    ):
+        if word.strip():
+            lines.setdefault((block, par, line), []).append(word)
+    parts = []
+    previous_par = None
+    for (block, par, _), words in lines.items():
+        if previous_par is not None and (block, par) != previous_par:
+            parts.append("")
+        parts.append(" ".join(words))
+        previous_par = (block, par)
+    return "\n".join(parts)
 
-def extract_text_from_scanned_pdf(pdf_path, dpi=300):
+def _ocr_page(img):
+    # image_to_data alone: the page text is rebuilt from its words instead of running Tesseract twice
+    ocr_data = pytesseract.image_to_data(
+        preprocess_image(img), lang="eng", config=TESSERACT_CONFIG, output_type=pytesseract.Output.DICT
+    )
+    return _text_from_ocr_data(ocr_data), ocr_data
+
+def _page_digest(img):
+    return hashlib.blake2b(img.tobytes(), digest_size=16).digest()
+
+def _encode_page(img):
+    # Lossless PNG at the fastest compression level: text scans shrink several-fold for IPC,
+    # and unlike JPEG no ringing is added around glyph edges before OCR
+    return cv2.imencode(".png", np.asarray(img), [cv2.IMWRITE_PNG_COMPRESSION, 1])[1].tobytes()
+
+def _ocr_page_payload(payload):
+    # Module-level so it can be pickled into ProcessPoolExecutor workers
+    return _ocr_page(cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_GRAYSCALE))
+
+def extract_text_from_scanned_pdf(pdf_source, dpi=OCR_DPI, workers=None, doc=None):
+    """
+    OCR every page. Returns (success, text, [ocr_data, ...]) with one image_to_data dict per page.
+    Page images are not kept; re-render them with iter_page_images at the same dpi.
+    Results are cached; callers must not modify them.
+    doc may be an already open fitz document for pdf_source, to avoid parsing the PDF again.
+    """
     try:
-        images = convert_from_path(pdf_path, dpi=dpi)
-        ocr_text = ""
-        ocr_data_pages = []
-        for img in images:
-            processed = preprocess_image(img)
-            text = pytesseract.image_to_string(processed, lang="eng")
-            ocr_data = pytesseract.image_to_data(processed, lang="eng", output_type=pytesseract.Output.DICT)
-            ocr_text += text + "\n"
-            ocr_data_pages.append((img, ocr_data))
-        return True, ocr_text, ocr_data_pages
+        cache_key = _ocr_cache_key(pdf_source, dpi)
+        with _ocr_cache_lock:
+            if cache_key in _ocr_cache:
+                _ocr_cache.move_to_end(cache_key)
+                return _ocr_cache[cache_key]
+        workers = workers or POOL_WORKERS
+        with _document(pdf_source, doc) as doc:
+            if doc.page_count > 1 and workers > 1:
+                # Submit each page as soon as it is rendered so OCR overlaps rendering, but keep at
+                # most two pages per worker in flight so memory stays bounded on long scans
+                results = []
+                pending = deque()
+                submitted = {}
+                executor = get_process_pool()
+                for img in iter_page_images(pdf_source, dpi, doc=doc):
+                    if len(pending) >= 2 * workers:
+                        results.append(pending.popleft().result())
+                    # Pixel-identical pages (blank separators, repeated forms) share one OCR job
+                    key = _page_digest(img)
+                    if key not in submitted:
+                        submitted[key] = executor.submit(_ocr_page_payload, _encode_page(img))
+                    pending.append(submitted[key])
+                results.extend(future.result() for future in pending)
+            else:
+                results = []
+                seen = {}
+                for img in iter_page_images(pdf_source, dpi, doc=doc):
+                    key = _page_digest(img)
+                    if key not in seen:
+                        seen[key] = _ocr_page(img)
+                    results.append(seen[key])
+            _retry_weak_pages(doc, results, dpi, workers)
+        ocr_text = "".join(text + "\n" for text, _ in results)
+        result = (True, ocr_text, [ocr_data for _, ocr_data in results])
+        with _ocr_cache_lock:
+            _ocr_cache[cache_key] = result
+            while len(_ocr_cache) > OCR_CACHE_SIZE:
+                _ocr_cache.popitem(last=False)
+        return result
+    except BrokenProcessPool as e:
+        logger.error(f"OCR worker pool failed: {e}")
+        reset_process_pool()
+        return False, "", []
     except Exception as e:
         logger.error(f"OCR extraction failed: {e}")
         return False, "", []
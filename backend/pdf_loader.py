@@ -1,60 +1,158 @@
 import fitz
 import logging
-from backend.ocr_utils import extract_text_from_scanned_pdf
+from concurrent.futures.process import BrokenProcessPool
+from typing import Tuple, Union
+from backend.ocr_utils import POOL_WORKERS, extract_text_from_scanned_pdf, get_process_pool, reset_process_pool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def extract_pdf_text(pdf_path: str) -> str:
+# Below this many pages, shipping the PDF to worker processes costs more than it saves
+PARALLEL_MIN_PAGES = 8
+# PDFs with less extractable text than this are treated as scanned and OCR'd
+SCANNED_TEXT_THRESHOLD = 100
+
+def open_pdf(pdf_source: Union[str, bytes]):
+    """
+    Open a PDF from a filesystem path or from its raw bytes.
+    """
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return fitz.open(stream=pdf_source, filetype="pdf")
+    return fitz.open(pdf_source)
+
+def _extract_segment(args) -> str:
+    # Module-level so it can be pickled; fitz documents cannot be shared across processes
+    pdf_source, start, stop = args
+    doc = open_pdf(pdf_source)
+    text = "".join(doc[i].get_text() for i in range(start, stop))
+    doc.close()
+    return text
+
+def extract_text_parallel(pdf_source: Union[str, bytes], page_count: int, workers=None) -> str:
+    """
+    Extract text from contiguous page ranges in worker processes, preserving page order.
+    """
+    workers = min(workers or POOL_WORKERS, page_count)
+    step = -(-page_count // workers)
+    segments = [(pdf_source, lo, min(lo + step, page_count)) for lo in range(0, page_count, step)]
+    return "".join(get_process_pool().map(_extract_segment, segments))
+
+def load_pdf_text(pdf_source: Union[str, bytes]) -> Tuple[str, bool]:
     """
-    Extract text from a PDF file, using OCR if the PDF is scanned.
+    Extract text from a PDF (path or bytes), using OCR if the PDF is scanned.
+    Returns (text, scanned); the digital text pass doubles as the scanned check.
     """
     try:
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        if len(text.strip()) < 100:
-            logger.info("PDF appears to be scanned. Using OCR...")
-            success, ocr_text, _ = extract_text_from_scanned_pdf(pdf_path)
-            if success:
-                return ocr_text
-        return text
+        with open_pdf(pdf_source) as doc:
+            page_count = doc.page_count
+            text = None
+            if page_count >= PARALLEL_MIN_PAGES and POOL_WORKERS > 1:
+                try:
+                    text = extract_text_parallel(pdf_source, page_count)
+                except BrokenProcessPool as e:
+                    # A dead worker breaks the shared pool for every later caller; replace it
+                    # and extract this document in-process instead of reporting it as empty
+                    logger.error(f"Text extraction worker pool failed: {e}; retrying sequentially")
+                    reset_process_pool()
+            if text is None:
+                text = "".join(page.get_text() for page in doc)
+            if len(text.strip()) < SCANNED_TEXT_THRESHOLD:
+                logger.info("PDF appears to be scanned. Using OCR...")
+                # Render the OCR pages from the document that is already open
+                success, ocr_text, _ = extract_text_from_scanned_pdf(pdf_source, doc=doc)
+                if success:
+                    return ocr_text, True
+                return text, True
+            return text, False
     except Exception as e:
         logger.error(f"Text extraction failed: {e}")
-        return ""
+        return "", False
+
+def extract_pdf_text(pdf_source: Union[str, bytes]) -> str:
+    """
+    Extract text from a PDF (path or bytes), using OCR if the PDF is scanned.
+    """
+    return load_pdf_text(pdf_source)[0]
+
+def _read_metadata(doc) -> dict:
+    return {
+        "author": doc.metadata.get("author", ""),
+        "title": doc.metadata.get("title", ""),
+        "page_count": doc.page_count,
+        "creation_date": doc.metadata.get("creationDate", ""),
+        "modification_date": doc.metadata.get("modDate", "")
+    }
 
-def get_pdf_metadata(pdf_path: str) -> dict:
+def get_pdf_metadata(pdf_source: Union[str, bytes]) -> dict:
     """
-    Extract metadata from the PDF.
+    Extract metadata from the PDF, given a path or the raw file bytes.
     """
     try:
-        doc = fitz.open(pdf_path)
-        metadata = {
-            "author": doc.metadata.get("author", ""),
-            "title": doc.metadata.get("title", ""),
-            "page_count": len(doc),
-            "creation_date": doc.metadata.get("creationDate", ""),
-            "modification_date": doc.metadata.get("modDate", "")
-        }
+        doc = open_pdf(pdf_source)
+        metadata = _read_metadata(doc)
         doc.close()
         return metadata
     except Exception as e:
         logger.error(f"Metadata extraction failed: {e}")
         return {}
 
-def is_scanned_pdf(pdf_path: str) -> bool:
+def is_scanned_pdf(pdf_source: Union[str, bytes]) -> bool:
     """
     Returns True if the PDF appears to be scanned (little or no extractable text).
     """
     try:
-        doc = fitz.open(pdf_path)
-        text = ""
+        doc = open_pdf(pdf_source)
+        # Stop at the first pages that add up to enough text; digital PDFs rarely need more than one
+        chars = 0
         for page in doc:
-            text += page.get_text()
+            chars += len(page.get_text().strip())
+            if chars >= SCANNED_TEXT_THRESHOLD:
+                break
         doc.close()
-        return len(text.strip()) < 100
+        return chars < SCANNED_TEXT_THRESHOLD
     except Exception as e:
         logger.error(f"Error checking if PDF is scanned: {e}")
         return False
+
+# PDF readers accept the header anywhere in the first kilobyte, after leading junk
+PDF_HEADER_WINDOW = 1024
+
+def has_pdf_header(head: bytes) -> bool:
+    """
+    Cheap pre-parse check shared by the app and the API: a '%PDF-' header within the first
+    PDF_HEADER_WINDOW bytes.
+    """
+    return b"%PDF-" in head[:PDF_HEADER_WINDOW]
+
+def _quick_pdf_ok(buf: bytes) -> bool:
+    """
+    Cheap structural check: PDF header near the start. A missing EOF marker near the end is only
+    logged; readers tolerate trailing bytes after it and PyMuPDF repairs the rest.
+    """
+    # /Root is not checked: PDFs with cross-reference streams may keep it well
+    # before the last kilobyte, so it would reject valid files.
+    if not has_pdf_header(buf):
+        return False
+    if b"%%EOF" not in buf[-1024:]:
+        logger.warning("No %%EOF marker in the last 1 KiB; trying to open the PDF anyway")
+    return True
+
+def probe_pdf(file_bytes: bytes) -> Tuple[dict, bool]:
+    """
+    Validate an in-memory PDF and read its metadata in the same open.
+    Returns (metadata, ok).
+    """
+    if not _quick_pdf_ok(file_bytes):
+        logger.warning("Upload rejected: missing PDF header")
+        return {}, False
+    try:
+        doc = open_pdf(file_bytes)
+        metadata = _read_metadata(doc)
+        doc.close()
+        return metadata, metadata["page_count"] > 0
+    except fitz.FileDataError as e:
+        logger.warning(f"Upload rejected: damaged or unsupported PDF ({e})")
+        return {}, False
+    except Exception as e:
+        logger.error(f"PDF probe failed: {e}")
+        return {}, False
@@ -1,35 +1,65 @@
 import fitz
+import io
 import logging
-from typing import List, Tuple, Optional
+import os
+import re
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures.process import BrokenProcessPool
 from backend.redactor import generate_fake_data, partial_redact
-from backend.ocr_utils import extract_text_from_scanned_pdf
-from PIL import ImageDraw
+from backend.ocr_utils import (
+    OCR_DPI, POOL_WORKERS, extract_text_from_scanned_pdf, get_process_pool, iter_page_images, reset_process_pool
+)
+from backend.pdf_loader import PARALLEL_MIN_PAGES, open_pdf
+from PIL import ImageDraw, ImageFont
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def draw_redaction(page, rect, redaction_type, text=None, font_size=11, custom_mask_text=None):
+_WHITESPACE_RE = re.compile(r"\s+")
+# Redacted scans are drawn on a colour render at this resolution, separate from the grayscale
+# OCR_DPI raster used for OCR; word boxes are scaled between the two
+SCANNED_OUTPUT_DPI = int(os.environ.get("SCANNED_OUTPUT_DPI", "300"))
+_OCR_TO_OUTPUT = SCANNED_OUTPUT_DPI / OCR_DPI
+# Loaded once and shared by every page instead of resolved again for each Draw
+_DEFAULT_FONT = ImageFont.load_default()
+
+def _normalize_text(text):
+    # Case- and whitespace-insensitive form for cheap "is it on this page" checks
+    return _WHITESPACE_RE.sub(" ", text).lower()
+
+def draw_redactions(page, redactions, redaction_type, font_size=11, custom_mask_text=None):
+    """
+    Draw all of a page's redactions as a single shape: every box, then any replacement text
+    on top, committed to the page once. redactions is a list of (rect, replacement_text) pairs.
+    """
     try:
-        if redaction_type == "black_bar":
-            page.draw_rect(rect, color=(0, 0, 0), fill=(0, 0, 0), overlay=True)
-        elif redaction_type == "white_bar":
-            page.draw_rect(rect, color=(1, 1, 1), fill=(1, 1, 1), overlay=True)
+        if redaction_type in ("black_bar", "white_bar"):
+            labelled = [(rect, None) for rect, _ in redactions]
         elif redaction_type == "custom" and custom_mask_text:
-            page.draw_rect(rect, color=(1, 1, 1), fill=(1, 1, 1), overlay=True)
-            page.insert_text(rect.tl, text=custom_mask_text, fontsize=font_size, color=(0, 0, 0))
+            labelled = [(rect, custom_mask_text) for rect, _ in redactions]
         elif redaction_type == "masked":
-            page.draw_rect(rect, color=(1, 1, 1), fill=(1, 1, 1), overlay=True)
-            page.insert_text(rect.tl, text="*" * len(text), fontsize=font_size, color=(0, 0, 0))
-        elif redaction_type == "numbered" and text:
-            page.draw_rect(rect, color=(1, 1, 1), fill=(1, 1, 1), overlay=True)
-            page.insert_text(rect.tl, text=text, fontsize=font_size, color=(0, 0, 0))
+            labelled = [(rect, "*" * len(text)) for rect, text in redactions]
+        elif redaction_type == "numbered":
+            labelled = [(rect, text) for rect, text in redactions if text]
         elif redaction_type == "random":
-            page.draw_rect(rect, color=(1, 1, 1), fill=(1, 1, 1), overlay=True)
-            page.insert_text(rect.tl, text=text, fontsize=font_size, color=(0, 0, 0))
-        elif redaction_type == "partial":
+            labelled = list(redactions)
+        else:
             # For digital PDFs, partial redaction is handled in redactor.py and not needed here.
-            pass
-        logger.info(f"Redacted {rect} with {redaction_type}")
+            return
+        if not labelled:
+            return
+        fill = (0, 0, 0) if redaction_type == "black_bar" else (1, 1, 1)
+        shape = page.new_shape()
+        for rect, _ in labelled:
+            shape.draw_rect(rect)
+        shape.finish(color=fill, fill=fill)
+        for rect, label in labelled:
+            if label:
+                shape.insert_text(rect.tl, label, fontsize=font_size, color=(0, 0, 0))
+        shape.commit(overlay=True)
+        # Lazy %-formatting: the message is only built if INFO records are actually emitted
+        logger.info("Redacted %d area(s) on page %d with %s", len(labelled), page.number + 1, redaction_type)
     except Exception as e:
         logger.error(f"Drawing redaction failed: {e}")
 
@@ -41,6 +71,135 @@ def find_text_instances(page, text_to_find):
         logger.error(f"Finding text instances failed: {e}")
         return []
 
+def _find_entities_on_page(page, entity_texts, normalized_entities):
+    """
+    Map entity index -> rects of its occurrences, for every entity whose text is on the page.
+    Returns (hits, length of the page's get_text()) so callers can place detection offsets on pages.
+    """
+    raw_text = page.get_text()
+    page_text = _normalize_text(raw_text)
+    hits = {}
+    for index, (entity_text, normalized) in enumerate(zip(entity_texts, normalized_entities)):
+        # Not on this page: skip the much costlier search_for
+        if normalized in page_text:
+            hits[index] = find_text_instances(page, entity_text)
+    return hits, len(raw_text)
+
+def _find_entities_segment(args):
+    # Module-level so it can be pickled; rects go back as plain tuples
+    pdf_source, start, stop, entity_texts, normalized_entities = args
+    doc = open_pdf(pdf_source)
+    pages = []
+    for page_num in range(start, stop):
+        hits, text_length = _find_entities_on_page(doc[page_num], entity_texts, normalized_entities)
+        pages.append(({index: [tuple(rect) for rect in rects] for index, rects in hits.items()}, text_length))
+    doc.close()
+    return pages
+
+def _find_entities_parallel(pdf_source, page_count, entity_texts, normalized_entities):
+    """
+    Search contiguous page ranges in worker processes, yielding each page's (hits, text length)
+    in page order. If the pool breaks, it is replaced and the remaining pages are searched here.
+    """
+    workers = min(POOL_WORKERS, page_count)
+    step = -(-page_count // workers)
+    segments = [
+        (pdf_source, lo, min(lo + step, page_count), entity_texts, normalized_entities)
+        for lo in range(0, page_count, step)
+    ]
+    done = 0
+    try:
+        for pages in get_process_pool().map(_find_entities_segment, segments):
+            for hits, text_length in pages:
+                yield {index: [fitz.Rect(rect) for rect in rects] for index, rects in hits.items()}, text_length
+                done += 1
+    except BrokenProcessPool as e:
+        logger.error(f"Redaction search worker pool failed: {e}; continuing sequentially")
+        reset_process_pool()
+        with open_pdf(pdf_source) as doc:
+            for page in doc.pages(done):
+                yield _find_entities_on_page(page, entity_texts, normalized_entities)
+
+def _draw_scanned_redactions(img, ocr_data, exact_index, last4_index, redaction_type, custom_mask_text, fake_values):
+    draw = ImageDraw.Draw(img)
+    for i, word in enumerate(ocr_data["text"]):
+        orig = word.strip()
+        if not orig:
+            continue
+        matches = exact_index.get(orig, [])
+        if last4_index:
+            # For partial, match last 4 digits/letters; keep the original entity order
+            matches = sorted(set(matches).union(last4_index.get(orig[-4:], [])))
+        if not matches:
+            continue
+        # Boxes are in OCR_DPI pixels; map them onto the SCANNED_OUTPUT_DPI page being drawn
+        x, y, w, h = (round(ocr_data[key][i] * _OCR_TO_OUTPUT) for key in ("left", "top", "width", "height"))
+        # Solid boxes are filled with paste, a plain C fill; +1 matches rectangle()'s inclusive corners
+        box = (x, y, x + w + 1, y + h + 1)
+        for _, entity_type in matches:
+            if redaction_type == "black_bar":
+                img.paste("black", box)
+            elif redaction_type == "white_bar":
+                img.paste("white", box)
+            elif redaction_type == "masked":
+                img.paste("white", box)
+                draw.text((x, y), "*" * len(orig), fill="black", font=_DEFAULT_FONT)
+            elif redaction_type == "random":
+                img.paste("white", box)
+                draw.text((x, y), fake_values[(entity_type, orig)], fill="black", font=_DEFAULT_FONT)
+            elif redaction_type == "custom" and custom_mask_text:
+                img.paste("white", box)
+                draw.text((x, y), custom_mask_text, fill="black", font=_DEFAULT_FONT)
+            elif redaction_type == "numbered":
+                img.paste("white", box)
+                draw.text((x, y), f"{entity_type}", fill="black", font=_DEFAULT_FONT)
+            elif redaction_type == "partial" and entity_type in ["PAN", "AADHAAR", "CREDIT_CARD"]:
+                masked = partial_redact(orig, entity_type)
+                img.paste("white", box)
+                draw.text((x, y), masked, fill="black", font=_DEFAULT_FONT)
+    return img
+
+def _encode_output_page(img):
+    # Full-chroma, high-quality JPEG: visually clean on colour scans at a fraction of flate's size
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=95, subsampling=0)
+    img.close()
+    return buffer.getvalue()
+
+def _redact_scanned_segment(args):
+    # Module-level so it can be pickled; pages go back already encoded for the output PDF
+    pdf_source, start, ocr_data_pages, *draw_args = args
+    stop = start + len(ocr_data_pages)
+    output_pages = iter_page_images(pdf_source, SCANNED_OUTPUT_DPI, start=start, stop=stop, color=True)
+    return [
+        _encode_output_page(
+            _draw_scanned_redactions(img, ocr_data, *draw_args)
+        )
+        for img, ocr_data in zip(output_pages, ocr_data_pages)
+    ]
+
+def _redact_scanned_parallel(pdf_source, ocr_data_pages, *draw_args):
+    """
+    Render and redact contiguous page ranges in worker processes, yielding encoded pages in order.
+    If the pool breaks, it is replaced and the remaining pages are redacted here.
+    """
+    page_count = len(ocr_data_pages)
+    workers = min(POOL_WORKERS, page_count)
+    step = -(-page_count // workers)
+    segments = [(pdf_source, lo, ocr_data_pages[lo:lo + step], *draw_args) for lo in range(0, page_count, step)]
+    done = 0
+    try:
+        for encoded in get_process_pool().map(_redact_scanned_segment, segments):
+            for page in encoded:
+                yield page
+                done += 1
+    except BrokenProcessPool as e:
+        logger.error(f"Scanned redaction worker pool failed: {e}; continuing sequentially")
+        reset_process_pool()
+        output_pages = iter_page_images(pdf_source, SCANNED_OUTPUT_DPI, start=done, color=True)
+        for img, ocr_data in zip(output_pages, ocr_data_pages[done:]):
+            yield _encode_output_page(_draw_scanned_redactions(img, ocr_data, *draw_args))
+
 def redact_pdf(
     input_pdf,
     output_pdf,
@@ -48,53 +207,88 @@ def redact_pdf(
     entities_to_redact,
     custom_mask_text=None,
     threshold=0.2,
-    scanned=False
+    scanned=False,
+    progress_callback=None
 ):
     """
     Redact PII in a PDF based on detected entities.
+    input_pdf may be a path or the raw PDF bytes; output_pdf may be a path or a writable file object.
+    progress_callback, if given, is called as progress_callback(pages_done, total_pages).
     For scanned PDFs, use OCR bounding boxes and draw on images.
     For digital PDFs, redact text layer as before.
     """
     if not scanned:
         # Digital PDF: redact as before
         try:
-            doc = fitz.open(input_pdf)
+            doc = open_pdf(input_pdf)
             redactions_applied = False
-            entity_counters = {}
-            if redaction_type == "numbered":
-                for _, entity_type, _, _ in entities_to_redact:
-                    if entity_type not in entity_counters:
-                        entity_counters[entity_type] = 0
+            # Detection lists every occurrence, but search_for already finds all of them on a page:
+            # search each distinct text once, numbering them per type in order of first appearance
+            entity_numbers = {}
+            entity_counters = Counter()
+            for entity_text, entity_type, _, _ in entities_to_redact:
+                if entity_text not in entity_numbers:
                     entity_counters[entity_type] += 1
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                for entity_text, entity_type, start, end in entities_to_redact:
-                    text_instances = find_text_instances(page, entity_text)
+                    entity_numbers[entity_text] = (entity_type, entity_counters[entity_type])
+            entity_texts = list(entity_numbers)
+            # Detection offsets index the joined get_text() of all pages, so they tell which page each
+            # occurrence was extracted from; sorted for a bisect per page
+            entity_index = {entity_text: index for index, entity_text in enumerate(entity_texts)}
+            detected_at = sorted((start, entity_index[entity_text]) for entity_text, _, start, _ in entities_to_redact)
+            detected_starts = [start for start, _ in detected_at]
+            page_start = 0
+            # Random stand-ins for this call only: consistent across pages, never across documents
+            fake_values = {}
+            normalized_entities = [_normalize_text(entity_text) for entity_text in entity_texts]
+            if len(doc) >= PARALLEL_MIN_PAGES and POOL_WORKERS > 1 and entity_texts:
+                # Text search dominates on long documents; drawing stays here on the one open doc
+                page_hits = _find_entities_parallel(input_pdf, len(doc), entity_texts, normalized_entities)
+            else:
+                page_hits = (_find_entities_on_page(page, entity_texts, normalized_entities) for page in doc)
+            for page_num, (hits, text_length) in enumerate(page_hits):
+                page_end = page_start + text_length
+                lo, hi = bisect_left(detected_starts, page_start), bisect_left(detected_starts, page_end)
+                for _, index in detected_at[lo:hi]:
+                    if index not in hits:
+                        # Extracted from this page but missed by the folded-text check (ligatures,
+                        # dehyphenation, reordered runs): search anyway rather than leave PII behind
+                        hits[index] = find_text_instances(doc[page_num], entity_texts[index])
+                page_start = page_end
+                page_redactions = []
+                for index, text_instances in hits.items():
+                    entity_text = entity_texts[index]
+                    entity_type, count_number = entity_numbers[entity_text]
                     replacement_text = None
                     if redaction_type == "random":
-                        replacement_text = generate_fake_data(entity_type, entity_text)
+                        if entity_text not in fake_values:
+                            fake_values[entity_text] = generate_fake_data(entity_type, entity_text)
+                        replacement_text = fake_values[entity_text]
                         if replacement_text and len(replacement_text) > len(entity_text):
                             replacement_text = replacement_text[:len(entity_text)]
                     elif redaction_type == "masked":
                         replacement_text = "*" * len(entity_text)
                     elif redaction_type == "numbered":
-                        entity_counters[entity_type] -= 1
-                        count_number = entity_counters[entity_type] + 1
                         replacement_text = f"{entity_type} {count_number}"
                     elif redaction_type == "custom":
                         replacement_text = custom_mask_text
                     elif redaction_type == "partial" and entity_type in ["PAN", "AADHAAR", "CREDIT_CARD"]:
                         replacement_text = partial_redact(entity_text, entity_type)
-                    for rect in text_instances:
-                        draw_redaction(
-                            page=page,
-                            rect=rect,
-                            redaction_type=redaction_type,
-                            text=replacement_text,
-                            custom_mask_text=custom_mask_text
-                        )
-                        redactions_applied = True
-            doc.save(output_pdf, garbage=4, deflate=True)
+                    page_redactions.extend((rect, replacement_text) for rect in text_instances)
+                if page_redactions:
+                    draw_redactions(
+                        page=doc.load_page(page_num),
+                        redactions=page_redactions,
+                        redaction_type=redaction_type,
+                        custom_mask_text=custom_mask_text
+                    )
+                    redactions_applied = True
+                if progress_callback:
+                    progress_callback(page_num + 1, len(doc))
+            if redactions_applied:
+                doc.save(output_pdf, garbage=4, deflate=True)
+            else:
+                # Callers treat False as "no output"; don't pay for a full rewrite nobody uses
+                logger.info("No redactions applied; skipping save")
             doc.close()
             return redactions_applied
         except Exception as e:
@@ -103,51 +297,53 @@ def redact_pdf(
     else:
         # Scanned PDF: redact on images using OCR bounding boxes
         try:
-            success, _, ocr_data_pages = extract_text_from_scanned_pdf(input_pdf)
+            doc = open_pdf(input_pdf)
+            success, _, ocr_data_pages = extract_text_from_scanned_pdf(input_pdf, doc=doc)
             if not success:
+                doc.close()
                 return False
-            from PIL import Image
-            import re
-            redacted_images = []
-            for img, ocr_data in ocr_data_pages:
-                draw = ImageDraw.Draw(img)
-                for i, word in enumerate(ocr_data["text"]):
-                    orig = word.strip()
-                    if not orig:
-                        continue
-                    for entity_text, entity_type, _, _ in entities_to_redact:
-                        # For partial, match last 4 digits/letters
-                        if (
-                            redaction_type == "partial"
-                            and entity_type in ["PAN", "AADHAAR", "CREDIT_CARD"]
-                            and orig[-4:] == entity_text.strip()[-4:]
-                        ) or (orig == entity_text.strip()):
-                            x, y, w, h = ocr_data['left'][i], ocr_data['top'][i], ocr_data['width'][i], ocr_data['height'][i]
-                            if redaction_type == "black_bar":
-                                draw.rectangle([x, y, x + w, y + h], fill="black")
-                            elif redaction_type == "white_bar":
-                                draw.rectangle([x, y, x + w, y + h], fill="white")
-                            elif redaction_type == "masked":
-                                draw.rectangle([x, y, x + w, y + h], fill="white")
-                                draw.text((x, y), "*" * len(orig), fill="black")
-                            elif redaction_type == "random":
-                                draw.rectangle([x, y, x + w, y + h], fill="white")
-                                draw.text((x, y), generate_fake_data(entity_type), fill="black")
-                            elif redaction_type == "custom" and custom_mask_text:
-                                draw.rectangle([x, y, x + w, y + h], fill="white")
-                                draw.text((x, y), custom_mask_text, fill="black")
-                            elif redaction_type == "numbered":
-                                draw.rectangle([x, y, x + w, y + h], fill="white")
-                                draw.text((x, y), f"{entity_type}", fill="black")
-                            elif redaction_type == "partial" and entity_type in ["PAN", "AADHAAR", "CREDIT_CARD"]:
-                                masked = partial_redact(orig, entity_type)
-                                draw.rectangle([x, y, x + w, y + h], fill="white")
-                                draw.text((x, y), masked, fill="black")
-                redacted_images.append(img.convert("RGB"))
-            # Save all images as PDF
-            if redacted_images:
-                redacted_images[0].save(output_pdf, save_all=True, append_images=redacted_images[1:])
+            # Index entities by stripped text (and, for partial, by last 4 characters) so each
+            # OCR word is a dict lookup instead of a scan over every entity
+            exact_index = {}
+            last4_index = {}
+            for order, (entity_text, entity_type, _, _) in enumerate(entities_to_redact):
+                key = entity_text.strip()
+                exact_index.setdefault(key, []).append((order, entity_type))
+                if redaction_type == "partial" and entity_type in ["PAN", "AADHAAR", "CREDIT_CARD"]:
+                    last4_index.setdefault(key[-4:], []).append((order, entity_type))
+            # Stand-ins are generated here, once per redact_pdf call, so every page (and every
+            # worker) uses the same value for the same entity without sharing it across documents
+            fake_values = {}
+            if redaction_type == "random":
+                fake_values = {(entity_type, key): generate_fake_data(entity_type, key)
+                               for key, matches in exact_index.items() for _, entity_type in matches}
+            draw_args = (exact_index, last4_index, redaction_type, custom_mask_text, fake_values)
+            if len(ocr_data_pages) >= PARALLEL_MIN_PAGES and POOL_WORKERS > 1:
+                pages = _redact_scanned_parallel(input_pdf, ocr_data_pages, *draw_args)
+            else:
+                # Pages are re-rendered one at a time in colour at the output resolution
+                pages = (
+                    _encode_output_page(_draw_scanned_redactions(img, ocr_data, *draw_args))
+                    for img, ocr_data in zip(
+                        iter_page_images(input_pdf, SCANNED_OUTPUT_DPI, doc=doc, color=True), ocr_data_pages
+                    )
+                )
+            # Each page goes into the output document as soon as it is redacted, so only one
+            # page image is held in memory however long the scan is
+            out = fitz.open()
+            for page_num, encoded in enumerate(pages):
+                # Keep the source page's size: the image is SCANNED_OUTPUT_DPI pixels per inch, not one per point
+                source_rect = doc[page_num].rect
+                new_page = out.new_page(width=source_rect.width, height=source_rect.height)
+                new_page.insert_image(new_page.rect, stream=encoded, keep_proportion=True)
+                if progress_callback:
+                    progress_callback(page_num + 1, len(ocr_data_pages))
+            doc.close()
+            if out.page_count:
+                out.save(output_pdf, garbage=4, deflate=True)
+                out.close()
                 return True
+            out.close()
             return False
         except Exception as e:
             logger.error(f"Image-based PDF redaction failed: {e}")
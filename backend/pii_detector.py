@@ -1,13 +1,16 @@
 import logging
+import os
+import re
 from typing import List, Optional, Tuple
 
 from presidio_analyzer import (
     AnalyzerEngine,
+    BatchAnalyzerEngine,
     RecognizerRegistry,
-    PatternRecognizer,
-    Pattern,
+    EntityRecognizer,
+    RecognizerResult,
 )
-from presidio_analyzer.nlp_engine import NlpEngineProvider
+from presidio_analyzer.nlp_engine import NlpArtifacts, NlpEngineProvider
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,59 +20,186 @@ SUPPORTED_ENTITIES = [
     "LOCATION", "ORGANIZATION", "PAN", "AADHAAR"
 ]
 
-_analyzer_instance = None
+# PAN: 5 letters, 4 digits, 1 letter (e.g., ABCDE1234F)
+# Aadhaar: 12 digits, often with spaces (e.g., 1234 5678 9012)
+ID_PATTERNS = {
+    "PAN": r"\b[A-Z]{5}[0-9]{4}[A-Z]\b",
+    "AADHAAR": r"\b\d{4}\s?\d{4}\s?\d{4}\b",
+}
+ID_PATTERN_SCORE = 0.85
 
-def initialize_analyzer():
+# One named-group alternation so the text is scanned once for every ID type.
+# Flags match Presidio's PatternRecognizer defaults.
+_ID_UNION_RE = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, pattern in ID_PATTERNS.items()),
+    re.DOTALL | re.MULTILINE | re.IGNORECASE
+)
+
+# Entity types whose recognizers can only match text containing a digit or '@'
+DIGIT_OR_AT_ENTITIES = {"PHONE_NUMBER", "EMAIL_ADDRESS", "CREDIT_CARD", "PAN", "AADHAAR"}
+_DIGIT_OR_AT_RE = re.compile(r"[\d@]")
+
+# Entity types that come from spaCy's NER; the rest are found by regex/rule recognizers
+NER_ENTITIES = {"PERSON", "LOCATION", "ORGANIZATION", "DATE_TIME"}
+
+# Long texts are split into line-bounded chunks and run through spaCy's nlp.pipe in batches
+PII_CHUNK_CHARS = int(os.getenv("PII_CHUNK_CHARS", "5000"))
+PII_BATCH_SIZE = int(os.getenv("PII_BATCH_SIZE", "32"))
+
+# spaCy models: en_core_web_lg (a declared dependency) for everything unless a faster model is
+# opted into with PII_SPACY_MODEL. That model must be installed separately and emit the OntoNotes
+# labels (PERSON, GPE/LOC, ORG, DATE/TIME) Presidio maps to PERSON/LOCATION/ORGANIZATION/DATE_TIME.
+ACCURATE_SPACY_MODEL = os.getenv("PII_SPACY_MODEL_ACCURATE", "en_core_web_lg")
+FAST_SPACY_MODEL = os.getenv("PII_SPACY_MODEL", ACCURATE_SPACY_MODEL)
+# Thresholds below this are sensitive runs and always use the accurate model
+ACCURATE_MODEL_THRESHOLD = 0.2
+
+_analyzer_instances = {}
+
+class IndianIdRecognizer(EntityRecognizer):
+    """
+    Recognizes PAN and Aadhaar numbers in a single regex pass.
+    """
+    def __init__(self):
+        super().__init__(supported_entities=list(ID_PATTERNS), name="IndianIdRecognizer")
+
+    def load(self):
+        pass
+
+    def analyze(self, text, entities, nlp_artifacts=None):
+        results = []
+        for match in _ID_UNION_RE.finditer(text):
+            if entities and match.lastgroup not in entities:
+                continue
+            results.append(RecognizerResult(
+                entity_type=match.lastgroup,
+                start=match.start(),
+                end=match.end(),
+                score=ID_PATTERN_SCORE
+            ))
+        return results
+
+def initialize_analyzer(model_name: str = ACCURATE_SPACY_MODEL):
     try:
         nlp_config = {
             "nlp_engine_name": "spacy",
-            "models": [{"lang_code": "en", "model_name": "en_core_web_lg"}]
+            "models": [{"lang_code": "en", "model_name": model_name}]
         }
         provider = NlpEngineProvider(nlp_configuration=nlp_config)
         nlp_engine = provider.create_engine()
         registry = RecognizerRegistry()
         registry.load_predefined_recognizers(nlp_engine=nlp_engine)
-        # PAN: 5 letters, 4 digits, 1 letter (e.g., ABCDE1234F)
-        pan_pattern = Pattern("pan_card", r"\b[A-Z]{5}[0-9]{4}[A-Z]\b", 0.85)
-        pan_recognizer = PatternRecognizer(supported_entity="PAN", patterns=[pan_pattern])
-        registry.add_recognizer(pan_recognizer)
-        # Aadhaar: 12 digits, often with spaces (e.g., 1234 5678 9012)
-        aadhaar_pattern = Pattern("aadhaar_card", r"\b\d{4}\s?\d{4}\s?\d{4}\b", 0.85)
-        aadhaar_recognizer = PatternRecognizer(supported_entity="AADHAAR", patterns=[aadhaar_pattern])
-        registry.add_recognizer(aadhaar_recognizer)
+        registry.add_recognizer(IndianIdRecognizer())
         analyzer = AnalyzerEngine(registry=registry, nlp_engine=nlp_engine)
-        logger.info("Presidio Analyzer initialized successfully")
+        logger.info(f"Presidio Analyzer initialized successfully with {model_name}")
         return analyzer
+    except SystemExit as e:
+        # Presidio falls back to spacy.cli.download for a missing model, which exits on failure
+        logger.error(f"Error initializing Presidio Analyzer: spaCy model {model_name} could not be loaded")
+        raise OSError(f"spaCy model {model_name} is not installed") from e
     except Exception as e:
         logger.error(f"Error initializing Presidio Analyzer: {str(e)}")
         raise
 
-def get_analyzer():
-    global _analyzer_instance
-    if _analyzer_instance is None:
-        _analyzer_instance = initialize_analyzer()
-    return _analyzer_instance
+def select_spacy_model(
+    high_accuracy: bool = False, threshold: float = 0.2, selected_entities: Optional[List[str]] = None
+) -> str:
+    """
+    Pick the spaCy model for a run: the accurate one when asked for or when the threshold is very low.
+    Pattern-only runs never reach spaCy, so they keep the default (already loaded) model.
+    """
+    if selected_entities is not None and not set(selected_entities) & NER_ENTITIES:
+        return FAST_SPACY_MODEL
+    if high_accuracy or threshold < ACCURATE_MODEL_THRESHOLD:
+        return ACCURATE_SPACY_MODEL
+    return FAST_SPACY_MODEL
+
+def get_analyzer(model_name: Optional[str] = None):
+    model_name = model_name or FAST_SPACY_MODEL
+    if model_name not in _analyzer_instances:
+        try:
+            _analyzer_instances[model_name] = initialize_analyzer(model_name)
+        except (Exception, SystemExit):
+            if model_name == ACCURATE_SPACY_MODEL:
+                raise
+            # The fast model is an optional install; keep working with the accurate one
+            logger.warning(f"spaCy model {model_name} unavailable; falling back to {ACCURATE_SPACY_MODEL}")
+            _analyzer_instances[model_name] = get_analyzer(ACCURATE_SPACY_MODEL)
+    return _analyzer_instances[model_name]
+
+def _split_chunks(text: str, max_chars: int = PII_CHUNK_CHARS) -> List[Tuple[int, str]]:
+    """
+    Split text into (offset, chunk) pieces of at most max_chars, cutting at a
+    newline (or failing that, a space) so entities are not split mid-word.
+    """
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            cut = text.rfind("\n", start, end)
+            if cut <= start:
+                cut = text.rfind(" ", start, end)
+            if cut > start:
+                end = cut + 1
+        chunks.append((start, text[start:end]))
+        start = end
+    return chunks
 
 def detect_pii_entities(
     text: str,
     threshold: float = 0.2,
-    selected_entities: Optional[List[str]] = None
+    selected_entities: Optional[List[str]] = None,
+    analyzer: Optional[AnalyzerEngine] = None
 ) -> List[Tuple[str, str, int, int]]:
     if not text or not isinstance(text, str):
         return []
+    if (
+        selected_entities
+        and set(selected_entities) <= DIGIT_OR_AT_ENTITIES
+        and not _DIGIT_OR_AT_RE.search(text)
+    ):
+        logger.info("No digits or '@' in text; skipping analysis for pattern-only entities")
+        return []
     try:
-        analyzer = get_analyzer()
-        results = analyzer.analyze(
-            text=text,
-            language='en',
-            entities=selected_entities,
-            score_threshold=threshold
-        )
+        analyzer = analyzer or get_analyzer()
+        skip_nlp = bool(selected_entities) and not set(selected_entities) & NER_ENTITIES
+        # Regex recognizers need no chunking; only spaCy benefits from batched input
+        chunks = [(0, text)] if skip_nlp else _split_chunks(text)
+        if skip_nlp:
+            # Pattern-only request: hand Presidio empty NLP artifacts so spaCy never runs
+            logger.info("No NER entity types requested; skipping spaCy")
+            nlp_artifacts = NlpArtifacts(
+                entities=[], tokens=[], tokens_indices=[], lemmas=[], nlp_engine=None, language='en'
+            )
+            chunk_results = [analyzer.analyze(
+                text=text,
+                language='en',
+                entities=selected_entities,
+                score_threshold=threshold,
+                nlp_artifacts=nlp_artifacts
+            )]
+        elif len(chunks) == 1:
+            chunk_results = [analyzer.analyze(
+                text=text,
+                language='en',
+                entities=selected_entities,
+                score_threshold=threshold
+            )]
+        else:
+            chunk_results = BatchAnalyzerEngine(analyzer_engine=analyzer).analyze_iterator(
+                texts=[chunk for _, chunk in chunks],
+                language='en',
+                batch_size=PII_BATCH_SIZE,
+                entities=selected_entities,
+                score_threshold=threshold
+            )
         entities = []
-        for result in results:
-            entity_text = text[result.start:result.end]
-            entities.append((entity_text, result.entity_type, result.start, result.end))
-        logger.info(f"Detected {len(entities)} PII entities with threshold {threshold}")
+        for (offset, chunk), results in zip(chunks, chunk_results):
+            for result in results:
+                entity_text = chunk[result.start:result.end]
+                entities.append((entity_text, result.entity_type, offset + result.start, offset + result.end))
+        logger.info("Detected %d PII entities with threshold %s", len(entities), threshold)
         return entities
     except Exception as e:
         logger.error(f"Error detecting PII entities: {str(e)}")
@@ -1,6 +1,8 @@
 from faker import Faker
 import logging
 import random
+import re
+from collections import Counter
 from typing import List, Tuple, Optional
 from presidio_anonymizer import AnonymizerEngine
 from presidio_anonymizer.entities import RecognizerResult, OperatorConfig
@@ -11,6 +13,9 @@ logger = logging.getLogger(__name__)
 fake = Faker()
 anonymizer = AnonymizerEngine()
 
+_NON_DIGIT_RE = re.compile(r'\D')
+_WHITESPACE_RE = re.compile(r'\s+')
+
 def generate_fake_data(entity_type, original_text=None):
     if entity_type == "PERSON":
         return fake.name()
@@ -34,9 +39,8 @@ def generate_fake_data(entity_type, original_text=None):
         return "REDACTED"
 
 def partial_redact(value, entity_type=None):
-    import re
     # Remove non-digits for Aadhaar/Credit Card, spaces for PAN
-    stripped = re.sub(r'\D', '', value) if entity_type in ["AADHAAR", "CREDIT_CARD"] else re.sub(r'\s+', '', value)
+    stripped = _NON_DIGIT_RE.sub('', value) if entity_type in ["AADHAAR", "CREDIT_CARD"] else _WHITESPACE_RE.sub('', value)
     if entity_type == "AADHAAR" and len(stripped) == 12:
         # Aadhaar: mask first 8, keep last 4, format as **** **** 1234
         masked = '**** **** ' + stripped[-4:]
@@ -80,14 +84,24 @@ def redact_pii(
     redaction_type: str = "random",
     selected_entities: Optional[List[str]] = None,
     threshold: float = 0.2,
-    custom_mask_text: Optional[str] = None
+    custom_mask_text: Optional[str] = None,
+    entities: Optional[List[Tuple[str, str, int, int]]] = None,
+    analyzer=None
 ):
-    entities = detect_pii_entities(text, threshold=threshold, selected_entities=selected_entities)
+    # Callers that already hold the detected spans can pass them in to skip re-detection
+    if entities is None:
+        entities = detect_pii_entities(
+            text,
+            threshold=threshold,
+            selected_entities=selected_entities,
+            analyzer=analyzer
+        )
+    else:
+        entities = list(entities)
     if not entities:
         logger.info("No PII entities detected.")
         return text, []
     pii_types = list(set(entity[1] for entity in entities))
-    anonymizer = AnonymizerEngine()
     presidio_results = [
         RecognizerResult(entity_type=entity_type, start=start, end=end, score=1.0)
         for _, entity_type, start, end in entities
@@ -117,11 +131,7 @@ def redact_pii(
         for entity_type in pii_types:
             operators[entity_type] = OperatorConfig("redact")
     elif redaction_type == "numbered":
-        entity_counters = {}
-        for _, entity_type, _, _ in entities:
-            if entity_type not in entity_counters:
-                entity_counters[entity_type] = 0
-            entity_counters[entity_type] += 1
+        entity_counters = Counter(entity_type for _, entity_type, _, _ in entities)
         redacted_text = text
         entities.sort(key=lambda x: x[2], reverse=True)
         for entity_text, entity_type, start, end in entities:
@@ -1,15 +1,19 @@
+import asyncio
+import hashlib
+import multiprocessing
 import os
 import re
 import shutil
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from typing import Dict, List
 
 import fitz  # PyMuPDF (For digital PDF processing)
 import spacy
-import pytesseract
-from pdf2image import convert_from_path
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.responses import FileResponse, JSONResponse
-from PIL import Image, ImageDraw
 from fastapi.middleware.cors import CORSMiddleware
 
 # ----------------------------
@@ -17,13 +21,27 @@ from fastapi.middleware.cors import CORSMiddleware
 # ----------------------------
 UPLOAD_FOLDER = "uploads"
 OUTPUT_FOLDER = "output"
+COPY_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MiB per read/write when storing uploads
+# Every pool worker imports this module and so holds its own en_core_web_lg (roughly 0.5-1 GB each);
+# the default stays well below the core count, raise CPU_WORKERS only where memory allows
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", max(1, min(4, (os.cpu_count() or 1) // 2))))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 # ----------------------------
 # Initialize FastAPI App
 # ----------------------------
-app = FastAPI(title="PDF Redaction API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One process pool per server process for the CPU-bound PyMuPDF/spaCy stages. forkserver on
+    # POSIX, as in backend/ocr_utils.py: forking the running, multi-threaded uvicorn process can
+    # leave a worker holding a lock another thread owned. Windows always spawns.
+    context = multiprocessing.get_context("forkserver") if os.name == "posix" else None
+    app.state.cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=context)
+    yield
+    app.state.cpu_pool.shutdown()
+
+app = FastAPI(title="PDF Redaction API", lifespan=lifespan)
 
 # ✅ Enable CORS for Frontend Integration
 app.add_middleware(
@@ -38,10 +56,21 @@ app.add_middleware(
 # Load SpaCy Model
 # ----------------------------
 try:
-    nlp = spacy.load("en_core_web_lg")  # Large model for better accuracy
+    # Large model for better accuracy; only NER output is used, so skip the tagger/parser stages
+    nlp = spacy.load("en_core_web_lg", disable=["tagger", "parser", "lemmatizer", "attribute_ruler"])
 except OSError:
     raise ImportError("SpaCy model not found! Install with: python -m spacy download en_core_web_lg")
 
+NLP_BATCH_SIZE = 32
+# Detection results for recently seen files, so re-uploads skip NER and regex entirely.
+# Keyed by content digest plus model version so a model upgrade never serves stale spans.
+PII_CACHE_SIZE = 32
+_NLP_VERSION = f"{nlp.meta['name']}-{nlp.meta['version']}"
+_pii_cache = OrderedDict()
+# Per-page results by text digest: headers, footers and form templates repeat across pages and files
+PAGE_PII_CACHE_SIZE = 512
+_page_pii_cache = OrderedDict()
+
 # ----------------------------
 # Expanded PII Detection Configuration
 # ----------------------------
@@ -59,68 +88,190 @@ REGEX_PATTERNS = {
     "IP_ADDRESS": r"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b",
 }
 
+# Compiled once at import instead of on every detect_pii call
+_COMPILED_PATTERNS = {key: re.compile(pattern, re.IGNORECASE) for key, pattern in REGEX_PATTERNS.items()}
+_WHITESPACE_RE = re.compile(r"\s+")
+
+class _FilenameTable(dict):
+    """str.translate table that keeps word characters, '-', '.' and ' ' and drops the rest.
+    Entries are filled on first use, so non-ASCII names work without a 1.1M-entry table."""
+    def __missing__(self, code: int):
+        ch = chr(code)
+        self[code] = keep = code if ch.isalnum() or ch in "_-. " else None
+        return keep
+
+# Built once; used for every upload and download request
+_SANITIZE_TABLE = _FilenameTable()
+_FNAME_OK = re.compile(r"^[\w\-. ]+\.pdf$", re.IGNORECASE)
+
 # ----------------------------
 # Utility Functions
 # ----------------------------
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extracts text from a digital PDF using PyMuPDF."""
-    doc = fitz.open(pdf_path)
-    return "\n".join([page.get_text("text") for page in doc])
+def sanitize_filename(name: str) -> str:
+    """Drops any directory part and characters outside [word, '-', '.', ' ']."""
+    return os.path.basename(name or "").translate(_SANITIZE_TABLE)
+
+def looks_like_pdf(fileobj) -> bool:
+    """Cheap pre-parse check: a '%PDF-' header within the first 1 KiB, as PDF readers accept it."""
+    # Same rule as backend.pdf_loader.has_pdf_header, kept local so the API does not import the OCR stack
+    head = fileobj.read(1024)
+    fileobj.seek(0)
+    return b"%PDF-" in head
+
+def file_digest(fileobj) -> str:
+    """BLAKE2b digest of a file object's contents, read in COPY_CHUNK_SIZE pieces; rewinds it afterwards."""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: fileobj.read(COPY_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+def store_upload(src, dst_path: str) -> None:
+    """Writes an upload to dst_path in large chunks."""
+    src.seek(0)
+    with open(dst_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, length=COPY_CHUNK_SIZE)
+
+def extract_pages_from_pdf(pdf_path: str) -> List[str]:
+    """Extracts the text of each page of a digital PDF using PyMuPDF."""
+    with fitz.open(pdf_path) as doc:
+        return [page.get_text("text") for page in doc]
 
 def detect_pii(text: str) -> Dict[str, List[str]]:
     """Detects PII in text using SpaCy NER & Regex matching."""
-    doc = nlp(text)
     pii_data = {"NER": {}, "REGEX": {}}
     
-    for ent in doc.ents:
-        if ent.label_ in PII_LABELS:
-            pii_data["NER"].setdefault(ent.label_, []).append(ent.text)
+    # Paragraph-sized pieces go through nlp.pipe in batches instead of one long nlp(text) call
+    paragraphs = [p for p in text.split("\n\n") if p.strip()]
+    for doc in nlp.pipe(paragraphs, batch_size=NLP_BATCH_SIZE):
+        for ent in doc.ents:
+            if ent.label_ in PII_LABELS:
+                pii_data["NER"].setdefault(ent.label_, []).append(ent.text)
+    # Each distinct string only needs redacting once; dict.fromkeys keeps first-seen order
+    for label, items in pii_data["NER"].items():
+        pii_data["NER"][label] = list(dict.fromkeys(items))
     
-    for key, pattern in REGEX_PATTERNS.items():
-        matches = re.findall(pattern, text, re.IGNORECASE)
+    for key, pattern in _COMPILED_PATTERNS.items():
+        matches = pattern.findall(text)
         if matches:
-            pii_data["REGEX"][key] = matches
+            pii_data["REGEX"][key] = list(dict.fromkeys(matches))
 
     return pii_data
 
-def redact_pdf_digital(input_path: str, output_path: str, pii_data: Dict[str, List[str]]) -> None:
-    """Redacts detected PII from a digital PDF."""
-    doc = fitz.open(input_path)
-    
-    for page in doc:
+def merge_pii_data(page_results: List[Dict[str, Dict[str, List[str]]]]) -> Dict[str, Dict[str, List[str]]]:
+    """Combines per-page detect_pii results into one result, keeping page order."""
+    pii_data = {"NER": {}, "REGEX": {}}
+    for result in page_results:
         for group in ["NER", "REGEX"]:
-            for category, items in pii_data[group].items():
-                for pii_text in items:
-                    areas = page.search_for(pii_text)
-                    for rect in areas:
-                        page.add_redact_annot(rect, fill=(0, 0, 0))  # Black out
-        page.apply_redactions()
-    
-    doc.save(output_path)
+            for category, items in result[group].items():
+                pii_data[group].setdefault(category, []).extend(items)
+    for group in ["NER", "REGEX"]:
+        for category, items in pii_data[group].items():
+            pii_data[group][category] = list(dict.fromkeys(items))
+    return pii_data
+
+async def detect_pii_pages(loop, cpu_pool, pages: List[str]) -> List[Dict[str, Dict[str, List[str]]]]:
+    """Returns the detect_pii result of every page, in page order, reusing cached results for pages seen before."""
+    # Repeated pages share one result, so each distinct text is analysed once
+    keys = {
+        page: (hashlib.blake2b(page.encode("utf-8"), digest_size=16).digest(), _NLP_VERSION)
+        for page in pages
+    }
+    # Take cached results before awaiting: a concurrent request may evict them meanwhile
+    found = {page: _page_pii_cache[key] for page, key in keys.items() if key in _page_pii_cache}
+    missing = [page for page in keys if page not in found]
+    results = await asyncio.gather(*(loop.run_in_executor(cpu_pool, detect_pii, page) for page in missing))
+    found.update(zip(missing, results))
+    for page, key in keys.items():
+        _page_pii_cache[key] = found[page]
+        _page_pii_cache.move_to_end(key)
+    while len(_page_pii_cache) > PAGE_PII_CACHE_SIZE:
+        _page_pii_cache.popitem(last=False)
+    return [found[page] for page in pages]
+
+def pii_strings(pii_data: Dict[str, Dict[str, List[str]]]) -> set:
+    """Distinct, stripped PII strings across all categories of a detect_pii result."""
+    return {
+        pii_text.strip()
+        for group in ["NER", "REGEX"]
+        for items in pii_data[group].values()
+        for pii_text in items
+        if pii_text.strip()
+    }
+
+def redact_pdf_digital(input_path: str, output_path: str, page_results: List[Dict[str, Dict[str, List[str]]]]) -> None:
+    """Redacts detected PII from a digital PDF, given the detect_pii result of each page."""
+    # The same string is often reported many times and under several categories;
+    # search each distinct one once per page
+    all_strings = pii_strings(merge_pii_data(page_results))
+    # Case/whitespace-folded forms for a cheap substring check before the costly search_for
+    folded_strings = [(pii_text, _WHITESPACE_RE.sub(" ", pii_text).lower()) for pii_text in all_strings]
+    redacted = False
+    with fitz.open(input_path) as doc:
+        for page, page_pii in zip(doc, page_results):
+            page_text = _WHITESPACE_RE.sub(" ", page.get_text("text")).lower()
+            # Strings detected in this page's own text are always searched: the folded check can miss
+            # text search_for still finds (ligatures, dehyphenation, reordered runs)
+            detected_here = pii_strings(page_pii)
+            page_redacted = False
+            for pii_text, folded in folded_strings:
+                if folded not in page_text and pii_text not in detected_here:
+                    continue
+                areas = page.search_for(pii_text)
+                for rect in areas:
+                    page.add_redact_annot(rect, fill=(0, 0, 0))  # Black out
+                    page_redacted = True
+            if page_redacted:
+                page.apply_redactions()
+                redacted = True
+        if redacted:
+            # Full rewrite: garbage collection drops the now-unreferenced original content streams
+            doc.save(output_path, garbage=4, deflate=True)
+    if not redacted:
+        # Nothing to remove: the upload is already the output, so skip re-serialising it
+        shutil.copyfile(input_path, output_path)
 
 @app.post("/redact-pdf/")
 async def redact_pdf_endpoint(file: UploadFile = File(...)):
     """Uploads a PDF, detects PII, and returns a redacted PDF."""
     
-    if not file.filename.lower().endswith(".pdf"):
+    filename = sanitize_filename(file.filename)
+    if not _FNAME_OK.match(filename):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    if not looks_like_pdf(file.file):
+        raise HTTPException(status_code=400, detail="Uploaded file is not a valid PDF")
     
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Nanosecond prefix keeps concurrent uploads with the same name apart without strftime work
+    stored_name = f"{time.time_ns()}_{filename}"
+    file_path = os.path.join(UPLOAD_FOLDER, stored_name)
+    cache_key = (file_digest(file.file), _NLP_VERSION)
+    store_upload(file.file, file_path)
 
-    text = extract_text_from_pdf(file_path)
-    pii_data = detect_pii(text)
-    output_filename = f"redacted_{file.filename}"
+    # CPU-bound PyMuPDF/spaCy work runs in the process pool so the event loop keeps serving
+    # requests and pages are analysed in parallel rather than serialised on the GIL
+    loop = asyncio.get_running_loop()
+    cpu_pool = app.state.cpu_pool
+    page_results = _pii_cache.get(cache_key)
+    if page_results is None:
+        pages = await loop.run_in_executor(cpu_pool, extract_pages_from_pdf, file_path)
+        page_results = await detect_pii_pages(loop, cpu_pool, pages)
+        _pii_cache[cache_key] = page_results
+        while len(_pii_cache) > PII_CACHE_SIZE:
+            _pii_cache.popitem(last=False)
+    else:
+        _pii_cache.move_to_end(cache_key)
+    output_filename = f"redacted_{stored_name}"
     output_path = os.path.join(OUTPUT_FOLDER, output_filename)
 
-    redact_pdf_digital(file_path, output_path, pii_data)  # ✅ Apply redaction
+    await loop.run_in_executor(cpu_pool, redact_pdf_digital, file_path, output_path, page_results)  # ✅ Apply redaction
 
     return JSONResponse({"filename": output_filename})
 
 @app.get("/output/{filename}")
 async def serve_file(filename: str):
     """Serves redacted PDFs for download."""
+    if not _FNAME_OK.match(filename):
+        raise HTTPException(status_code=404, detail="File not found")
     file_path = os.path.join(OUTPUT_FOLDER, filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
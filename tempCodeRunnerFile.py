@@ -1 +0,0 @@
-import magic
\ No newline at end of file